@@ -3,53 +3,181 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 from datetime import datetime
+import time
+import os
+import hashlib
+import ijson
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import google_sheets
 import cloudinary_uploader
 
 # --- Constants ---
 ICON_OPTIONS = ["Default (●)", "🌵", "🌊", "❄️", "🌲", "🪨", "⛏️", "👨‍🌾", "🏡", "👑", "👾"]
-ICON_MAP_REVERSE = {
-    "Default (●)": "Default",
-    "🌵": "🌵",
-    "🌊": "🌊",
-    "❄️": "❄️",
-    "🌲": "🌲",
-    "🪨": "🪨",
-    "⛏️": "⛏️",
-    "👨‍🌾": "👨‍🌾",
-    "🏡": "🏡",
-    "👑": "👑",
-    "👾": "👾"
-}
-ICON_MAP_DISPLAY = {v: k for k, v in ICON_MAP_REVERSE.items()}
+# Only the default marker has a display label that differs from its stored value;
+# emoji icons are stored as-is, so look these up with .get(key, key)
+ICON_MAP_REVERSE = {"Default (●)": "Default"}
+ICON_MAP_DISPLAY = {"Default": "Default (●)"}
+ICON_OPTION_INDEX = {opt: i for i, opt in enumerate(ICON_OPTIONS)}
+BG_OPTIONS = ["Default (#F5DEB3)", "Light Blue"]
+BG_OPTION_INDEX = {opt: i for i, opt in enumerate(BG_OPTIONS)}
+BG_LUT = {"Default (#F5DEB3)": "rgba(0,0,0,0)", "Light Blue": "lightblue"}  # Option -> marker colour
+SYNC_INTERVAL_SECONDS = 30
+MAX_UPLOAD_WORKERS = cloudinary_uploader.UPLOAD_POOL_SIZE  # One pooled connection per upload worker
+LOCAL_DATA_FILE = "locations.json"
+WEBGL_MARKER_THRESHOLD = 200  # Default markers switch from SVG to WebGL above this count
 
 # --- Setup ---
 st.set_page_config(page_title="Minecraft World Mapper", layout="wide")
 
 # --- Backend Functions ---
 
+def normalize_loc(loc):
+    """
+    Fills missing fields (and blank optional ones) with their defaults, in place,
+    so the rest of the app can index them directly. Returns the same dict.
+    """
+    loc.setdefault("name", "")
+    for coord in ("x", "y", "z"):
+        loc.setdefault(coord, None)
+    loc["icon"] = loc.get("icon") or "Default"
+    loc["bg_color"] = loc.get("bg_color") or BG_OPTIONS[0]
+    loc["description"] = loc.get("description") or ""
+
+    # Legacy records stored a single image under "image_path"
+    legacy_path = loc.pop("image_path", None)
+    if not isinstance(loc.get("image_paths"), list):
+        # Warning: Local image paths won't work in cloud unless re-uploaded
+        # For now, just keep the path string, but it will appear broken
+        loc["image_paths"] = [legacy_path] if legacy_path else []
+    return loc
+
 def load_data():
-    """Loads location data from Google Sheets."""
-    return google_sheets.load_data()
+    """Loads location data from Google Sheets (cached there across sessions)."""
+    return [normalize_loc(loc) for loc in google_sheets.load_data()]
 
 def save_data(data):
-    """Saves location data to Google Sheets."""
+    """Overwrites the whole sheet with location data."""
     return google_sheets.save_all_data(data)
 
+def save_changes(upserts, deletes):
+    """Writes only the changed location rows to Google Sheets."""
+    return google_sheets.apply_changes(upserts, deletes)
+
+def queue_write(loc_id, op):
+    """
+    Records a pending Sheets write ("add", "update" or "delete") for a location.
+    Repeated changes to the same location collapse into a single write.
+    """
+    pending = st.session_state.pending_writes
+    if not pending:
+        st.session_state.dirty_since = time.time()
+
+    previous = pending.get(loc_id)
+    if previous == "add" and op == "delete":
+        # The row never reached the sheet, so there is nothing to delete
+        del pending[loc_id]
+    elif previous != "add":
+        pending[loc_id] = op
+
+def flush_writes():
+    """Pushes all pending writes to Google Sheets in one batch. Returns True if nothing is left pending."""
+    pending = st.session_state.pending_writes
+    if not pending:
+        return True
+
+    locations = st.session_state.locations
+    upserts = [locations[loc_id] for loc_id, op in pending.items() if op != "delete"]
+    deletes = [loc_id for loc_id, op in pending.items() if op == "delete"]
+
+    # Adds are written as upserts, so retrying after a partial failure never duplicates rows
+    if save_changes(upserts, deletes):
+        pending.clear()
+    return not pending
+
+@st.fragment(run_every=SYNC_INTERVAL_SECONDS)
+def sync_panel():
+    """Flushes pending writes on the first timer tick after a change, or on demand."""
+    pending = st.session_state.pending_writes
+    sync_clicked = st.button("💾 Sync to Cloud", disabled=not pending)
+
+    # A fragment-only run that isn't the button click is the run_every tick: flush everything queued,
+    # so no change waits past the next tick. Full-app reruns only flush changes that are already overdue.
+    ctx = get_script_run_ctx()
+    timer_tick = bool(ctx and ctx.fragment_ids_this_run) and not sync_clicked
+    overdue = pending and (timer_tick or time.time() - st.session_state.dirty_since >= SYNC_INTERVAL_SECONDS)
+
+    if sync_clicked or overdue:
+        with st.spinner("Syncing to Google Sheets..."):
+            flush_writes()
+
+    if pending:
+        st.caption(f"⏳ {len(pending)} unsynced change(s)")
+    else:
+        st.caption("✅ All changes synced")
+
 def save_image(uploaded_file):
     """Uploads image to Cloudinary and returns the URL."""
     if uploaded_file is None:
         return None
     return cloudinary_uploader.upload_image(uploaded_file)
 
+def image_digest(uploaded_file):
+    """Content hash used to recognise an image that was already uploaded."""
+    return hashlib.blake2b(uploaded_file.getvalue(), digest_size=16).hexdigest()
+
+def save_images(uploaded_files):
+    """
+    Uploads several images to Cloudinary concurrently.
+    Files whose content was already uploaded this session reuse the stored URL.
+    Returns (urls, failed_names); urls keeps the upload order without duplicates.
+    """
+    if not uploaded_files:
+        return [], []
+
+    url_cache = st.session_state.upload_hash_cache
+    digests = [image_digest(f) for f in uploaded_files]
+
+    # One upload per distinct image that is not cached yet
+    to_upload = {}
+    for digest, f in zip(digests, uploaded_files):
+        if digest not in url_cache and digest not in to_upload:
+            to_upload[digest] = f
+
+    if to_upload and not cloudinary_uploader.init_cloudinary():
+        to_upload = {}
+
+    if to_upload:
+        # Worker threads need the script context so st.error() inside the uploader still renders
+        ctx = get_script_run_ctx()
+
+        def attach_ctx():
+            add_script_run_ctx(threading.current_thread(), ctx)
+
+        with ThreadPoolExecutor(max_workers=min(MAX_UPLOAD_WORKERS, len(to_upload)), initializer=attach_ctx) as ex:
+            for digest, url in zip(to_upload, ex.map(save_image, to_upload.values())):
+                if url:
+                    url_cache[digest] = url
+
+    urls, failed_names = [], []
+    for digest, f in zip(digests, uploaded_files):
+        url = url_cache.get(digest)
+        if not url:
+            failed_names.append(f.name)
+        elif url not in urls:
+            urls.append(url)
+    return urls, failed_names
+
 # --- UI ---
 
 st.title("🗺️ Minecraft World Mapper")
 
 # Validating Data exists & Init Session State
+# locations maps id -> location dict; dicts keep insertion order, which the map relies on
 if "locations" not in st.session_state:
     with st.spinner("Loading data from Google Sheets..."):
-        st.session_state.locations = load_data()
+        st.session_state.locations = {loc["id"]: loc for loc in load_data()}
 
 if "edit_mode" not in st.session_state:
     st.session_state.edit_mode = False
@@ -57,6 +185,13 @@ if "edit_mode" not in st.session_state:
 if "edit_id" not in st.session_state:
     st.session_state.edit_id = None
 
+if "pending_writes" not in st.session_state:
+    st.session_state.pending_writes = {}
+    st.session_state.dirty_since = 0.0
+
+if "upload_hash_cache" not in st.session_state:
+    st.session_state.upload_hash_cache = {}
+
 # --- Sidebar: Add New Location ---
 with st.sidebar:
     st.header("📍 Add New Location")
@@ -64,8 +199,8 @@ with st.sidebar:
         name = st.text_input("Location Name (Optional)")
         
         selected_icon_display = st.selectbox("Map Icon", options=ICON_OPTIONS)
-        selected_icon_value = ICON_MAP_REVERSE[selected_icon_display]
-        selected_bg_color = st.selectbox("Icon Background Color", options=["Default (#F5DEB3)", "Light Blue"])
+        selected_icon_value = ICON_MAP_REVERSE.get(selected_icon_display, selected_icon_display)
+        selected_bg_color = st.selectbox("Icon Background Color", options=BG_OPTIONS)
         
         col1, col2 = st.columns(2)
         with col1:
@@ -89,12 +224,9 @@ with st.sidebar:
             image_paths = []
             if uploaded_images:
                 with st.spinner("Uploading images to Cloudinary..."):
-                    for img_file in uploaded_images:
-                        url = save_image(img_file)
-                        if url:
-                            image_paths.append(url)
-                        else:
-                            st.warning(f"Failed to upload {img_file.name}")
+                    image_paths, failed_names = save_images(uploaded_images)
+                for failed_name in failed_names:
+                    st.warning(f"Failed to upload {failed_name}")
 
             new_location = {
                 "id": datetime.now().strftime("%Y%m%d%H%M%S"),
@@ -107,130 +239,284 @@ with st.sidebar:
                 "icon": selected_icon_value,
                 "bg_color": selected_bg_color
             }
-            st.session_state.locations.append(new_location)
-            save_data(st.session_state.locations)
-            st.success(f"Location '{final_name}' saved!")
-            st.rerun()
+            st.session_state.locations[new_location["id"]] = new_location
+            queue_write(new_location["id"], "add")
+            # The map renders after the sidebar in this same run, so no st.rerun() is needed
+            st.success(f"Location '{final_name}' added! It syncs to the cloud within {SYNC_INTERVAL_SECONDS}s (see the sync status below).")
 
     # --- Sidebar: Data Migration ---
     with st.expander("🔧 Data Migration (Restore Old Data)"):
         st.write("If you can't see your old locations, use this to upload them to the cloud.")
+        # All file I/O stays behind the button so ordinary reruns never touch the disk
         if st.button("Load from 'locations.json' & Upload"):
-            import json
-            import os
-            Local_Data_File = "locations.json"
-            if os.path.exists(Local_Data_File):
+            if os.path.exists(LOCAL_DATA_FILE):
                 try:
-                    with open(Local_Data_File, "r", encoding="utf-8") as f:
-                        old_data = json.load(f)
-                    
-                    if old_data:
-                        # Append to current data
-                        st.info(f"Found {len(old_data)} local records. Uploading...")
-                        
-                        # Merge logic: Avoid duplicates by ID
-                        current_ids = {loc["id"] for loc in st.session_state.locations}
-                        added_count = 0
-                        
-                        for item in old_data:
+                    # Merge logic: Avoid duplicates by ID
+                    locations = st.session_state.locations
+                    record_count = 0
+                    # Collected separately so a file that fails mid-stream leaves the map untouched
+                    new_locations = {}
+
+                    # Stream records one by one instead of loading the whole backup into memory
+                    with open(LOCAL_DATA_FILE, "rb") as f:
+                        for item in ijson.items(f, "item", use_float=True):
+                            record_count += 1
+
                             # Compatibility fix: ensure new fields exist
-                            if "icon" not in item: item["icon"] = "Default"
-                            if "image_paths" not in item:
-                                if "image_path" in item and item["image_path"]:
-                                     # Warning: Local image paths won't work in cloud unless re-uploaded
-                                     # For now, just keep the path string, but it will appear broken
-                                     item["image_paths"] = [item["image_path"]] 
-                                else:
-                                     item["image_paths"] = []
-                            if "image_path" in item: del item["image_path"]
-
-                            if item["id"] not in current_ids:
-                                st.session_state.locations.append(item)
-                                added_count += 1
-                        
-                        if added_count > 0:
-                            save_data(st.session_state.locations)
-                            st.success(f"Successfully migrated {added_count} locations!")
-                            st.rerun()
+                            normalize_loc(item)
+
+                            if item["id"] not in locations and item["id"] not in new_locations:
+                                new_locations[item["id"]] = item
+
+                    if record_count == 0:
+                        st.warning("Local file is empty.")
+                    elif new_locations:
+                        locations.update(new_locations)
+                        added_count = len(new_locations)
+                        # Full rewrite already includes any pending edits
+                        if save_data(list(locations.values())):
+                            st.session_state.pending_writes.clear()
+                            st.success(f"Successfully migrated {added_count} of {record_count} local records!")
                         else:
-                            st.warning("All local locations are already in the cloud.")
+                            # Keep them as pending adds so the next sync retries
+                            for loc_id in new_locations:
+                                queue_write(loc_id, "add")
+                            st.warning(f"Loaded {added_count} of {record_count} local records; they will be uploaded on the next sync.")
                     else:
-                        st.warning("Local file is empty.")
+                        st.warning("All local locations are already in the cloud.")
                 except Exception as e:
                     st.error(f"Error reading local file: {e}")
             else:
                 st.error("'locations.json' not found in project directory.")
 
-# --- Main Page: Map ---
+    # --- Sidebar: Cloud Sync ---
+    # Rendered after everything that can queue writes, so its status is current for this run
+    sync_panel()
 
-locations_data = st.session_state.locations
+# --- Main Page: Map ---
 
-if locations_data:
-    df = pd.DataFrame(locations_data)
+def render_edit_panel(loc_to_edit):
+    """Edit form for one location; Update/Cancel/Delete rerun the whole app so the map refreshes."""
+    # Every control, including Cancel/Delete, sits behind the form barrier so
+    # checkbox toggles and button clicks cost a single rerun on submit
+    with st.form("edit_location_form", clear_on_submit=False):
+        new_name = st.text_input("Name", value=loc_to_edit['name'])
+
+        # Icon Selection
+        current_icon_val = loc_to_edit["icon"]
+        current_display = ICON_MAP_DISPLAY.get(current_icon_val, current_icon_val)
+        index_val = ICON_OPTION_INDEX.get(current_display, 0)
+
+        new_icon_display = st.selectbox("Icon", options=ICON_OPTIONS, index=index_val)
+        new_icon_value = ICON_MAP_REVERSE.get(new_icon_display, new_icon_display)
+
+        current_bg_val = loc_to_edit["bg_color"]
+        bg_idx = BG_OPTION_INDEX.get(current_bg_val, 0)
+        new_bg_color = st.selectbox("Icon Background Color", options=BG_OPTIONS, index=bg_idx)
+
+        c1, c2 = st.columns(2)
+        new_x = c1.number_input("X", value=loc_to_edit['x'], step=1)
+        new_z = c2.number_input("Z", value=loc_to_edit['z'], step=1)
+        new_y = st.number_input("Y", value=loc_to_edit['y'], step=1)
+        new_desc = st.text_area("Description", value=loc_to_edit['description'])
+
+        # Show existing images with delete option
+        current_images = loc_to_edit["image_paths"]
+        st.caption("Existing Images:")
+
+        images_to_keep = []
+
+        if current_images:
+            for i, img_url in enumerate(current_images):
+                # Fetch a 100px Cloudinary thumbnail instead of the full-size original
+                st.image(cloudinary_uploader.thumbnail_url(img_url, 100), width=100)
+
+                if not st.checkbox("Delete", key=f"del_img_{i}_{loc_to_edit['id']}"):
+                    images_to_keep.append(img_url)
+
+        st.caption("Add more images:")
+        new_images_upload = st.file_uploader("Upload", type=["jpg", "png", "jpeg"], accept_multiple_files=True)
+
+        c_update, c_cancel, c_delete = st.columns(3)
+        submitted_update = c_update.form_submit_button("Update", type="primary")
+        cancelled = c_cancel.form_submit_button("Cancel")
+        deleted = c_delete.form_submit_button("Delete", type="primary")
+
+    if submitted_update:
+        final_new_name = new_name.strip() if new_name else f"Location @ {new_x}, {new_z}"
+        loc_to_edit['name'] = final_new_name
+        loc_to_edit['x'] = new_x
+        loc_to_edit['y'] = new_y
+        loc_to_edit['z'] = new_z
+        loc_to_edit['description'] = new_desc
+        loc_to_edit['icon'] = new_icon_value
+        loc_to_edit['bg_color'] = new_bg_color
+
+        loc_to_edit['image_paths'] = images_to_keep
+
+        if new_images_upload:
+            with st.spinner("Uploading..."):
+                new_urls, failed_names = save_images(new_images_upload)
+            loc_to_edit['image_paths'].extend(url for url in new_urls if url not in loc_to_edit['image_paths'])
+            for failed_name in failed_names:
+                st.warning(f"Failed to upload {failed_name}")
+
+        queue_write(loc_to_edit["id"], "update")
+        st.session_state.edit_mode = False
+        st.session_state.edit_id = None
+        # The map above is already drawn, so this rerun is needed; a toast survives it
+        st.toast("Updated!")
+        st.rerun()
+
+    elif cancelled:
+        st.session_state.edit_mode = False
+        st.session_state.edit_id = None
+        st.rerun()
+
+    elif deleted:
+        st.session_state.locations.pop(loc_to_edit["id"], None)
+        queue_write(loc_to_edit["id"], "delete")
+
+        st.session_state.edit_mode = False
+        st.session_state.edit_id = None
+        st.toast("Deleted!")
+        st.rerun()
+
+def render_details_panel(loc_data, selected_count):
+    """Read-only details for one selected location."""
+    # Icon + Name
+    icon_display = loc_data['icon']
+    if icon_display == 'Default': icon_display = '📍'
+
+    st.markdown(f"### {icon_display} {loc_data['name']}")
+
+    # Image Carousel
+    image_paths = loc_data["image_paths"]
+    if image_paths:
+        if len(image_paths) == 1:
+            st.image(image_paths[0], width="stretch")
+        else:
+            # st.tabs would load every image up-front; only render the chosen one
+            img_idx = st.radio(
+                "Image",
+                options=range(len(image_paths)),
+                format_func=lambda i: f"Img {i+1}",
+                horizontal=True,
+                label_visibility="collapsed",
+                key=f"img_idx_{loc_data['id']}"
+            )
+            st.image(image_paths[img_idx], width="stretch")
+
+    st.markdown(f"**Coords**: `{loc_data['x']}, {loc_data['y']}, {loc_data['z']}`")
+
+    if loc_data["description"]:
+        st.markdown("**Description:**")
+        st.write(loc_data["description"])
+
+    st.caption(f"ID: {loc_data['id']}")
+
+    if st.button("📝 Edit", key=f"btn_edit_{loc_data['id']}"):
+        st.session_state.edit_mode = True
+        st.session_state.edit_id = loc_data['id']
+        st.rerun(scope="app")
     
-    # Ensure 'icon' column exists
-    if "icon" not in df.columns:
-        df["icon"] = "Default"
-    if "bg_color" not in df.columns:
-        df["bg_color"] = "Default (#F5DEB3)"
-
-    # Split DataFrames
-    df_default = df[df["icon"] == "Default"].copy()
-    df_emoji = df[df["icon"] != "Default"].copy()
-
+    if selected_count > 1:
+        st.info(f"And {selected_count-1} other locations selected.")
+
+def build_figure(points):
+    """Builds the map figure from (id, x, z, icon, bg_color, name) tuples."""
+    # Split into per-trace columns in a single pass
+    default_ids, default_x, default_z, default_names = [], [], [], []
+    emoji_ids, emoji_x, emoji_z, emoji_icons, emoji_bg, emoji_names = [], [], [], [], [], []
+    for loc_id, x, z, icon, bg_color, name in points:
+        if icon == "Default":
+            default_ids.append(loc_id)
+            default_x.append(x)
+            default_z.append(z)
+            default_names.append(name)
+        else:
+            emoji_ids.append(loc_id)
+            emoji_x.append(x)
+            emoji_z.append(z)
+            emoji_icons.append(icon)
+            emoji_bg.append(bg_color)
+            emoji_names.append(name)
+
+    # Base Figure
+    fig = go.Figure()
+
+    # Default Markers (skipped when empty; selection is resolved via customdata, not trace index)
+    if default_ids:
+        # SVG is crisper for small maps; WebGL keeps large ones responsive
+        scatter_cls = go.Scattergl if len(default_ids) >= WEBGL_MARKER_THRESHOLD else go.Scatter
+        fig.add_trace(scatter_cls(
+            x=default_x,
+            y=default_z,
+            mode='markers',
+            marker=dict(size=12, line=dict(width=2, color='DarkSlateGrey')),
+            text=default_names,
+            hoverinfo='text',
+            name="Markers",
+            customdata=default_ids # Store ID for selection
+        ))
+
+    # Emoji Markers (always SVG, Scattergl has limited text support)
+    if emoji_ids:
+        bg_color_mapped = [BG_LUT.get(bg, "rgba(0,0,0,0)") for bg in emoji_bg]
+
+        fig.add_trace(go.Scatter(
+            x=emoji_x,
+            y=emoji_z,
+            mode='markers+text',
+            text=emoji_icons,
+            textfont=dict(size=20),
+            marker=dict(size=26, color=bg_color_mapped, line=dict(width=0)),
+            hovertext=emoji_names,
+            hoverinfo='text',
+            name="Icons",
+            customdata=emoji_ids # Store ID for selection
+        ))
+
+    fig.update_layout(
+        title="World Map (X vs Z)",
+        xaxis_title="X Coordinate",
+        yaxis_title="Z Coordinate",
+        height=600,
+        clickmode='event+select',
+        plot_bgcolor='#F5DEB3',
+        margin=dict(l=0, r=0, t=30, b=0)
+    )
+
+    return fig
+
+def current_figure(points):
+    """
+    Returns this session's map figure, rebuilding it only when the plotted points changed.
+    st.cache_data would pickle the Figure and a hit costs more than a rebuild; st.plotly_chart
+    does not mutate the figure, so the last one is kept as-is in session state.
+    """
+    cached = st.session_state.get("map_figure")
+    if cached is None or cached[0] != points:
+        cached = (points, build_figure(points))
+        st.session_state.map_figure = cached
+    return cached[1]
+
+@st.fragment
+def map_view(locations):
+    """
+    Renders the map and the details panel.
+    Map clicks only rerun this fragment; edits still rerun the whole app.
+    """
     # --- Layout: Map (Left) vs Details (Right) ---
     col_map, col_details = st.columns([2, 1])
 
     with col_map:
-        # Base Figure
-        fig = go.Figure()
-
-        # Trace 0: Default Markers
-        if not df_default.empty:
-            fig.add_trace(go.Scatter(
-                x=df_default["x"],
-                y=df_default["z"],
-                mode='markers',
-                marker=dict(size=12, line=dict(width=2, color='DarkSlateGrey')),
-                text=df_default["name"],
-                hoverinfo='text',
-                name="Markers",
-                customdata=df_default["id"] # Store ID for selection
-            ))
-        else:
-            fig.add_trace(go.Scatter(x=[], y=[], mode='markers', name="Markers"))
-
-        # Trace 1: Emoji Markers
-        if not df_emoji.empty:
-            bg_color_mapped = df_emoji["bg_color"].map({
-                "Default (#F5DEB3)": "rgba(0,0,0,0)",
-                "Light Blue": "lightblue"
-            }).fillna("rgba(0,0,0,0)")
-
-            fig.add_trace(go.Scatter(
-                x=df_emoji["x"],
-                y=df_emoji["z"],
-                mode='markers+text',
-                text=df_emoji["icon"],
-                textfont=dict(size=20),
-                marker=dict(size=26, color=bg_color_mapped, line=dict(width=0)),
-                hovertext=df_emoji["name"],
-                hoverinfo='text',
-                name="Icons",
-                customdata=df_emoji["id"] # Store ID for selection
-            ))
-        else:
-            fig.add_trace(go.Scatter(x=[], y=[], mode='markers+text', name="Icons"))
-
-        fig.update_layout(
-            title="World Map (X vs Z)",
-            xaxis_title="X Coordinate",
-            yaxis_title="Z Coordinate",
-            height=600,
-            clickmode='event+select',
-            plot_bgcolor='#F5DEB3',
-            margin=dict(l=0, r=0, t=30, b=0)
+        # Projection of the plotted fields, so unchanged data reuses the last figure
+        points = tuple(
+            (loc["id"], loc["x"], loc["z"], loc["icon"], loc["bg_color"], loc["name"])
+            for loc in locations.values()
         )
+        fig = current_figure(points)
 
         event = st.plotly_chart(fig, on_select="rerun", selection_mode="points", use_container_width=True, config={'scrollZoom': True})
     
@@ -248,95 +534,10 @@ if locations_data:
             st.info("✏️ Edit Mode Active")
             
             # Find the location to edit
-            edit_index = next((i for i, item in enumerate(st.session_state.locations) if item["id"] == st.session_state.edit_id), -1)
+            loc_to_edit = st.session_state.locations.get(st.session_state.edit_id)
             
-            if edit_index != -1:
-                loc_to_edit = st.session_state.locations[edit_index]
-                
-                with st.form("edit_location_form"):
-                    new_name = st.text_input("Name", value=loc_to_edit['name'])
-                    
-                    # Icon Selection
-                    current_icon_val = loc_to_edit.get("icon", "Default")
-                    current_display = ICON_MAP_DISPLAY.get(current_icon_val, "Default (●)")
-                    index_val = ICON_OPTIONS.index(current_display) if current_display in ICON_OPTIONS else 0
-                    
-                    new_icon_display = st.selectbox("Icon", options=ICON_OPTIONS, index=index_val)
-                    new_icon_value = ICON_MAP_REVERSE[new_icon_display]
-
-                    current_bg_val = loc_to_edit.get("bg_color", "Default (#F5DEB3)")
-                    bg_options = ["Default (#F5DEB3)", "Light Blue"]
-                    bg_idx = bg_options.index(current_bg_val) if current_bg_val in bg_options else 0
-                    new_bg_color = st.selectbox("Icon Background Color", options=bg_options, index=bg_idx)
-
-                    c1, c2 = st.columns(2)
-                    new_x = c1.number_input("X", value=loc_to_edit['x'], step=1)
-                    new_z = c2.number_input("Z", value=loc_to_edit['z'], step=1)
-                    new_y = st.number_input("Y", value=loc_to_edit['y'], step=1)
-                    new_desc = st.text_area("Description", value=loc_to_edit['description'])
-                    
-                    # Show existing images with delete option
-                    current_images = loc_to_edit.get("image_paths", [])
-                    st.caption("Existing Images:")
-                    
-                    images_to_keep = []
-                    
-                    if current_images:
-                        for i, img_url in enumerate(current_images):
-                            if img_url.startswith("http"):
-                                st.image(img_url, width=100)
-                            else:
-                                st.image(img_url, width=100)
-
-                            if not st.checkbox("Delete", key=f"del_img_{i}_{st.session_state.edit_id}"):
-                                images_to_keep.append(img_url)
-                    
-                    st.caption("Add more images:")
-                    new_images_upload = st.file_uploader("Upload", type=["jpg", "png", "jpeg"], accept_multiple_files=True)
-                    
-                    submitted_update = st.form_submit_button("Update", type="primary")
-
-                if submitted_update:
-                    final_new_name = new_name.strip() if new_name else f"Location @ {new_x}, {new_z}"
-                    loc_to_edit['name'] = final_new_name
-                    loc_to_edit['x'] = new_x
-                    loc_to_edit['y'] = new_y
-                    loc_to_edit['z'] = new_z
-                    loc_to_edit['description'] = new_desc
-                    loc_to_edit['icon'] = new_icon_value
-                    loc_to_edit['bg_color'] = new_bg_color
-                    
-                    loc_to_edit['image_paths'] = images_to_keep
-
-                    if new_images_upload:
-                        with st.spinner("Uploading..."):
-                            for img_file in new_images_upload:
-                                url = save_image(img_file)
-                                if url:
-                                    loc_to_edit['image_paths'].append(url)
-                    
-                    save_data(st.session_state.locations)
-                    st.session_state.edit_mode = False
-                    st.session_state.edit_id = None
-                    st.success("Updated!")
-                    st.rerun()
-                
-                c_cancel, c_delete = st.columns([1, 1])
-                with c_cancel:
-                    if st.button("Cancel"):
-                        st.session_state.edit_mode = False
-                        st.session_state.edit_id = None
-                        st.rerun()
-                
-                with c_delete:
-                    if st.button("Delete", type="primary"):
-                        st.session_state.locations.pop(edit_index)
-                        save_data(st.session_state.locations)
-                        
-                        st.session_state.edit_mode = False
-                        st.session_state.edit_id = None
-                        st.success("Deleted!")
-                        st.rerun()
+            if loc_to_edit is not None:
+                render_edit_panel(loc_to_edit)
 
             else:
                 st.error("Location not found.")
@@ -345,50 +546,25 @@ if locations_data:
 
         # Normal Details View
         elif selected_ids:
-            # Filter DF by selected ID (Handling multiple selections by showing first or list)
+            # Look up only the selected ids; ids whose location was since deleted are skipped
             # Default to showing the first selected one for simplicity in side-panel
+            selected_locs = [locations[i] for i in selected_ids if i in locations]
             
-            selected_id = selected_ids[0]
-            loc_data = next((item for item in st.session_state.locations if item["id"] == selected_id), None)
-            
-            if loc_data:
-                # Icon + Name
-                icon_display = loc_data.get('icon', 'Default')
-                if icon_display == 'Default': icon_display = '📍'
-                
-                st.markdown(f"### {icon_display} {loc_data['name']}")
-                
-                # Image Carousel
-                image_paths = loc_data.get("image_paths", [])
-                if image_paths:
-                    if len(image_paths) == 1:
-                        st.image(image_paths[0], use_column_width=True)
-                    else:
-                        tabs = st.tabs([f"Img {i+1}" for i in range(len(image_paths))])
-                        for i, tab in enumerate(tabs):
-                            tab.image(image_paths[i], use_column_width=True)
-
-                st.markdown(f"**Coords**: `{loc_data['x']}, {loc_data['y']}, {loc_data['z']}`")
-                
-                if loc_data["description"]:
-                    st.markdown("**Description:**")
-                    st.write(loc_data["description"])
-                
-                st.caption(f"ID: {loc_data['id']}")
-                
-                if st.button("📝 Edit", key=f"btn_edit_{loc_data['id']}"):
-                    st.session_state.edit_mode = True
-                    st.session_state.edit_id = loc_data['id']
-                    st.rerun()
-                
-                if len(selected_ids) > 1:
-                    st.info(f"And {len(selected_ids)-1} other locations selected.")
+            if selected_locs:
+                render_details_panel(selected_locs[0], len(selected_locs))
 
         else:
             st.info("Select a location on the map to see details here.")
             
-            with st.expander("List View"):
-                st.dataframe(df[["name", "x", "z", "icon"]], height=200)
-
+            # A collapsed expander still ships its table to the browser; a toggle builds it only when shown
+            if st.toggle("Show list view", key="show_list"):
+                list_df = pd.DataFrame(
+                    [(loc["name"], loc["x"], loc["z"], loc["icon"]) for loc in locations.values()],
+                    columns=["name", "x", "z", "icon"]
+                )
+                st.dataframe(list_df, height=200)
+
+if st.session_state.locations:
+    map_view(st.session_state.locations)
 else:
     st.info("No locations recorded yet. Use the sidebar to add your first discovery!")
@@ -2,43 +2,91 @@ import streamlit as st
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
+import cloudinary.utils
+
+# Set to True to print secrets/config diagnostics next to upload errors
+_DEBUG = False
+
+# Kept-alive HTTPS connections to the upload API; matches the app's upload worker count
+UPLOAD_POOL_SIZE = 8
+
+# Files above this size are sent in chunks of this size (Cloudinary's minimum chunk is 5MB)
+LARGE_UPLOAD_CHUNK_SIZE = 6_000_000
+
+# Read once at import; stays None if the [cloudinary] secrets are missing
+try:
+    _CLOUDINARY_CONFIG = {
+        key: st.secrets["cloudinary"][key]
+        for key in ("cloud_name", "api_key", "api_secret")
+    }
+except Exception:
+    _CLOUDINARY_CONFIG = None
+
+@st.cache_resource(show_spinner=False)
+def _configure_cloudinary():
+    """Applies the Cloudinary config once per process."""
+    if _CLOUDINARY_CONFIG is None:
+        raise KeyError("cloudinary is missing from secrets")
+
+    cloudinary.config(
+        **_CLOUDINARY_CONFIG,
+        secure = True
+    )
+    # The SDK's shared urllib3 pool keeps only one connection per host, so every concurrent
+    # upload beyond the first would open (and then throw away) its own TLS connection
+    cloudinary.uploader._http = cloudinary.utils.get_http_connector(
+        cloudinary.config(),
+        dict(cloudinary.CERT_KWARGS, maxsize=UPLOAD_POOL_SIZE)
+    )
+    return True
 
 def init_cloudinary():
-    """Initializes Cloudinary configuration from secrets."""
+    """Initializes Cloudinary configuration from secrets (cached after the first success)."""
     try:
-        cloudinary.config(
-            cloud_name = st.secrets["cloudinary"]["cloud_name"],
-            api_key = st.secrets["cloudinary"]["api_key"],
-            api_secret = st.secrets["cloudinary"]["api_secret"],
-            secure = True
-        )
-        return True
+        return _configure_cloudinary()
     except Exception as e:
         st.error(f"Cloudinary configuration error: {e}")
         return False
 
 def upload_image(image_file):
     """
-    Uploads an image to Cloudinary.
+    Uploads an image to Cloudinary. Call init_cloudinary() once beforehand.
     Returns the secure URL of the uploaded image or None if failed.
+    Safe to call from worker threads.
     """
-    if not init_cloudinary():
-        return None
-
     try:
-        # Determine if it's a file-like object or bytes
-        # Cloudinary's upload function handles file-like objects directly
-        response = cloudinary.uploader.upload(image_file)
+        # Cloudinary's upload functions read file-like objects directly
+        image_file.seek(0)
+
+        if getattr(image_file, "size", 0) > LARGE_UPLOAD_CHUNK_SIZE:
+            # Read and send one chunk at a time instead of building one large multipart body.
+            # upload_large closes the stream, which is fine: Streamlit hands out new UploadedFile objects every run.
+            response = cloudinary.uploader.upload_large(
+                image_file,
+                chunk_size=LARGE_UPLOAD_CHUNK_SIZE,
+                resource_type="image"
+            )
+        else:
+            # Small files fit in a single request; chunking would only add round-trips
+            response = cloudinary.uploader.upload(image_file)
         
         return response.get("secure_url")
             
     except Exception as e:
-        # Debugging: Print more details
         st.error(f"Error uploading to Cloudinary: {type(e).__name__} - {e}")
-        # Check if secrets are loaded
-        try:
-             cloud_name = st.secrets["cloudinary"]["cloud_name"]
-             st.error(f"Secrets loaded. Cloud name: {cloud_name}")
-        except:
-             st.error("Could not load Cloudinary secrets.")
+        if _DEBUG:
+            # Check if secrets are loaded
+            if _CLOUDINARY_CONFIG:
+                 st.info(f"Secrets loaded. Cloud name: {_CLOUDINARY_CONFIG['cloud_name']}")
+            else:
+                 st.error("Could not load Cloudinary secrets.")
         return None
+
+def thumbnail_url(url, size=100):
+    """
+    Rewrites a Cloudinary delivery URL so it serves a size x size thumbnail.
+    Non-Cloudinary URLs and local paths are returned unchanged.
+    """
+    if "res.cloudinary.com" not in url or "/upload/" not in url:
+        return url
+    return url.replace("/upload/", f"/upload/w_{size},h_{size},c_fill,q_auto,f_auto/", 1)
@@ -1,8 +1,13 @@
 import streamlit as st
 import gspread
+from gspread.utils import numericise
 from google.oauth2.service_account import Credentials
 import pandas as pd
-import json
+import orjson
+import math
+
+# Set to True to print connection diagnostics (service account email) in the app
+_DEBUG = False
 
 # Scopes required for the API
 SCOPES = [
@@ -10,26 +15,63 @@ SCOPES = [
     "https://www.googleapis.com/auth/drive"
 ]
 
+# Column order used when the sheet has no header row yet
+COLUMNS = ["id", "name", "x", "y", "z", "description", "icon", "image_paths", "bg_color"]
+
+# Secrets are read once at import; None means they are missing and is reported on first use
+try:
+    _CREDS_DICT = dict(st.secrets["gcp_service_account"])
+    # fix formatting of private key if necessary (replace \n with actual newlines)
+    _CREDS_DICT["private_key"] = _CREDS_DICT["private_key"].replace("\\n", "\n")
+except Exception:
+    _CREDS_DICT = None
+
+try:
+    # Remove any leading/trailing whitespace
+    _SHEET_ID = str(st.secrets["sheets"]["spreadsheet_id"]).strip()
+except Exception:
+    _SHEET_ID = None
+
+# The cached helpers below raise instead of returning None: Streamlit only caches return
+# values, so a failure is retried on the next call. The public wrappers catch and report it.
+@st.cache_resource(show_spinner=False)
+def _build_client():
+    """Builds the gspread client once per process."""
+    if _CREDS_DICT is None:
+        raise KeyError("gcp_service_account is missing from secrets")
+
+    credentials = Credentials.from_service_account_info(
+        _CREDS_DICT,
+        scopes=SCOPES
+    )
+    return gspread.authorize(credentials)
+
 def get_gspread_client():
     """Authenticates and returns a gspread client using Streamlit secrets."""
     try:
-        # Load credentials from secrets
-        creds_dict = dict(st.secrets["gcp_service_account"])
-        
-        # fix formatting of private key if necessary (replace \n with actual newlines)
-        if "\\n" in creds_dict["private_key"]:
-             creds_dict["private_key"] = creds_dict["private_key"].replace("\\n", "\n")
-
-        credentials = Credentials.from_service_account_info(
-            creds_dict,
-            scopes=SCOPES
-        )
-        client = gspread.authorize(credentials)
-        return client
+        return _build_client()
     except Exception as e:
         st.error(f"Failed to authenticate with Google Sheets: {e}")
         return None
 
+@st.cache_resource(show_spinner=False)
+def _open_worksheet(sheet_id):
+    """Opens the configured spreadsheet once per process."""
+    client = _build_client()
+    if sheet_id.startswith("http"):
+        sh = client.open_by_url(sheet_id)
+    else:
+        sh = client.open_by_key(sheet_id)
+    return sh.sheet1
+
+@st.cache_resource(show_spinner=False)
+def _open_first_accessible():
+    """Fallback lookup of the first spreadsheet shared with the service account. Raises if there is none."""
+    accessible = _build_client().openall()
+    if not accessible:
+        raise LookupError("no accessible sheets")
+    return accessible[0]
+
 def get_worksheet():
     """Opens the spreadsheet and returns the first worksheet."""
     client = get_gspread_client()
@@ -37,42 +79,31 @@ def get_worksheet():
         return None
     
     try:
-        # Remove any leading/trailing whitespace
-        sheet_id = str(st.secrets["sheets"]["spreadsheet_id"]).strip()
-        
-        # Debug: Show masked ID
-        masked_id = f"{sheet_id[:5]}...{sheet_id[-5:]}" if len(sheet_id) > 10 else sheet_id
-        st.info(f"Using Spreadsheet ID/URL: {masked_id}")
+        sheet_id = _SHEET_ID
+        if not sheet_id:
+            raise KeyError("sheets.spreadsheet_id is missing from secrets")
 
-        # Debug: Show which email is trying to access
-        try:
-            email = st.secrets["gcp_service_account"]["client_email"]
-            # st.info(f"Attempting to access with email: {email}") # Commented out to reduce clutter
-        except:
-             pass
+        if _DEBUG:
+            # Debug: Show which email is trying to access
+            email = (_CREDS_DICT or {}).get("client_email")
+            st.info(f"Attempting to access with email: {email}")
         
         try:
              # Try to open by the configured ID/URL
-            if sheet_id.startswith("http"):
-                sh = client.open_by_url(sheet_id)
-            else:
-                sh = client.open_by_key(sheet_id)
-            return sh.sheet1
+            return _open_worksheet(sheet_id)
             
         except Exception as open_err:
             # Fallback: If specific ID failed, look at what we CAN see
             st.warning(f"Could not open by ID ({sheet_id[:5]}...). Checking accessible sheets...")
             
             try:
-                accessible = client.openall()
-                if accessible:
-                    target_sheet = accessible[0]
-                    st.success(f"Found accessible sheet: '{target_sheet.title}'. Using this one!")
-                    st.info(f"👉 Recommended: Update your secrets.toml with this ID: {target_sheet.id}")
-                    return target_sheet.sheet1
-                else:
-                     st.error("No accessible sheets found. Please share your sheet with the email above.")
-                     return None
+                target_sheet = _open_first_accessible()
+                st.success(f"Found accessible sheet: '{target_sheet.title}'. Using this one!")
+                st.info(f"👉 Recommended: Update your secrets.toml with this ID: {target_sheet.id}")
+                return target_sheet.sheet1
+            except LookupError:
+                st.error("No accessible sheets found. Please share your sheet with the service account's client_email.")
+                return None
             except Exception as e:
                 st.error(f"Error checking accessible sheets: {e}")
                 return None
@@ -81,44 +112,71 @@ def get_worksheet():
         st.error(f"Unexpected error: {e}")
         return None
 
-def load_data():
-    """Loads all data from the Google Sheet and returns it as a list of dicts."""
+def _parse_image_paths(value):
+    """Parses a stored image_paths cell (one URL per line, or a legacy JSON list) into a list."""
+    try:
+        # Legacy rows were written as JSON lists
+        if value.startswith("["):
+            return orjson.loads(value)
+        # One URL per line; a cell without a newline is a single entry, even if it contains commas
+        return [url.strip() for url in value.split("\n") if url.strip()]
+    except ValueError:
+        return []
+
+def _parse_coordinate(value):
+    """Converts a coordinate cell to int/float, or None if it is blank."""
+    return numericise(value, default_blank=None)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _load_records():
+    """
+    Reads and parses every row of the sheet. Cached for 10 minutes and cleared by every write.
+    """
     worksheet = get_worksheet()
     if not worksheet:
+        raise ConnectionError("worksheet is not available")
+
+    # One call for the raw grid; parsing happens column-wise below
+    rows = worksheet.get_all_values()
+    if len(rows) < 2:
         return []
-    
-    try:
-        records = worksheet.get_all_records()
-        
-        # Post-processing: Handle JSON fields (image_paths)
-        cleaned_records = []
-        for row in records:
-            # Ensure image_paths is a list
-            if "image_paths" in row and isinstance(row["image_paths"], str):
-                try:
-                    # Try parsing as JSON if it looks like a list
-                    if row["image_paths"].startswith("["):
-                        row["image_paths"] = json.loads(row["image_paths"])
-                    elif row["image_paths"]:
-                         # Fallback for comma separated or single url
-                        row["image_paths"] = [url.strip() for url in row["image_paths"].split(",") if url.strip()]
-                    else:
-                        row["image_paths"] = []
-                except:
-                    row["image_paths"] = []
-            
-            # Ensure missing coordinates are properly cast to None instead of empty strings
-            for col in ["x", "y", "z"]:
-                if col in row and row[col] == "":
-                    row[col] = None
 
-            cleaned_records.append(row)
-            
-        return cleaned_records
+    df = pd.DataFrame(rows[1:], columns=rows[0])
+
+    # Post-processing: Split image_paths back into lists
+    if "image_paths" in df.columns:
+        df["image_paths"] = df["image_paths"].map(_parse_image_paths)
+
+    # Raw values are text: turn coordinates back into numbers and blank ones into None.
+    # Built as object columns so pandas cannot coerce a mix of ints and None into float/NaN.
+    for col in ["x", "y", "z"]:
+        if col in df.columns:
+            df[col] = pd.Series([_parse_coordinate(v) for v in df[col]], index=df.index, dtype=object)
+
+    return df.to_dict("records")
+
+def load_data():
+    """Loads all data from the Google Sheet and returns it as a list of dicts."""
+    try:
+        return _load_records()
     except Exception as e:
         st.error(f"Error reading data from Google Sheet: {e}")
         return []
 
+def _row_to_values(loc, header):
+    """Serializes a location dict into a sheet row following the header order."""
+    row = []
+    for col in header:
+        value = loc.get(col, "")
+        if col == "image_paths":
+            # URLs never contain newlines, so one per line needs no JSON framing
+            value = "\n".join(value) if isinstance(value, list) else ""
+        elif value is None or (isinstance(value, float) and math.isnan(value)):
+            # Missing values are written as blank cells; NaN is not valid JSON for the Sheets API
+            value = ""
+        row.append(value)
+    return row
+
 def save_all_data(data):
     """
     Overwrites the Google Sheet with the provided data.
@@ -132,41 +190,87 @@ def save_all_data(data):
     try:
         if not data:
             worksheet.clear()
+            _load_records.clear()
             return True
 
-        # Prepare data for upload
-        # We need to serialize lists (like image_paths) to strings/JSON
-        df = pd.DataFrame(data)
-        
-        # Ensure consistent columns
-        required_cols = ["id", "name", "x", "y", "z", "description", "icon", "image_paths"]
-        for col in required_cols:
-            if col not in df.columns:
-                df[col] = "" # Fill missing columns
-        
-        # Convert image_paths list to JSON string for storage
-        df["image_paths"] = df["image_paths"].apply(lambda x: json.dumps(x) if isinstance(x, list) else "[]")
-        
-        # Replace NaN/None with empty strings to prevent Google Sheets API JSON serialization errors
-        df = df.fillna("")
-        
-        # Update session state with the serialized version? No, we shouldn't touch the passed data object if possible.
-        # But we made a new DF, so it's fine.
+        # Known columns first, then anything extra the records carry
+        header = list(COLUMNS)
+        for loc in data:
+            for col in loc:
+                if col not in header:
+                    header.append(col)
+
+        # Serialize each record straight to a row; image_paths becomes one URL per line
+        values = [_row_to_values(loc, header) for loc in data]
 
         # Clear and update
         worksheet.clear()
         
-        # set_with_dataframe is from gspread-dataframe usually, but we are using pure gspread
-        # gspread uses list of lists.
-        # Header
-        header = df.columns.tolist()
-        # Values
-        values = df.values.tolist()
-        
         # Update
         worksheet.update([header] + values)
+        _load_records.clear()
         return True
         
     except Exception as e:
         st.error(f"Error saving data to Google Sheet: {e}")
         return False
+
+def _get_header(worksheet):
+    """Returns the header row, adding any missing known columns to it first."""
+    header = worksheet.row_values(1)
+    missing = [col for col in COLUMNS if col not in header]
+    if missing:
+        header = header + missing
+        worksheet.update(range_name="A1", values=[header])
+    return header
+
+def apply_changes(upserts, deletes):
+    """
+    Writes a batch of location changes without rewriting the sheet.
+    `upserts` are location dicts (updated in place if their id exists, appended otherwise),
+    `deletes` are location ids. Row numbers come from a single read of the id column,
+    then edits, appends and deletes each go out as one API call.
+    """
+    worksheet = get_worksheet()
+    if not worksheet:
+        return False
+
+    try:
+        header = _get_header(worksheet)
+
+        # 1-based sheet row of every stored id (row 1 is the header)
+        id_cells = worksheet.col_values(header.index("id") + 1)
+        row_by_id = {value: row for row, value in enumerate(id_cells, start=1) if row > 1}
+
+        updates = []
+        appends = []
+        for loc in upserts:
+            row = row_by_id.get(str(loc["id"]))
+            if row:
+                updates.append({"range": f"A{row}", "values": [_row_to_values(loc, header)]})
+            else:
+                appends.append(_row_to_values(loc, header))
+
+        if updates:
+            worksheet.batch_update(updates, value_input_option="RAW")
+        if appends:
+            worksheet.append_rows(appends, value_input_option="RAW", insert_data_option="INSERT_ROWS")
+
+        # Delete bottom-up so earlier deletions don't shift the remaining row numbers
+        delete_rows = sorted({row_by_id[str(loc_id)] for loc_id in deletes if str(loc_id) in row_by_id}, reverse=True)
+        if delete_rows:
+            worksheet.spreadsheet.batch_update({"requests": [
+                {"deleteDimension": {"range": {
+                    "sheetId": worksheet.id,
+                    "dimension": "ROWS",
+                    "startIndex": row - 1,
+                    "endIndex": row
+                }}}
+                for row in delete_rows
+            ]})
+
+        _load_records.clear()
+        return True
+    except Exception as e:
+        st.error(f"Error saving changes to Google Sheet: {e}")
+        return False